@@ -1,11 +1,22 @@
 import argparse
+import bisect
+import glob
+import hashlib
+import ijson
 import logging
-import json
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 import os
 from dotenv import load_dotenv
 import re
-from typing import List, Dict, Any
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from itertools import groupby
+from operator import attrgetter, itemgetter
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -17,30 +28,100 @@ load_dotenv()
 # Get API key from environment
 PRIVATE_AI_API_KEY = os.environ.get('PRIVATE_AI_API_KEY')
 
+PRIVATE_AI_URL = "https://api.private-ai.com/community/v3/process/text"
+
+# Whitespace-delimited words; matches the tokens produced by str.split()
+WORD_PATTERN = re.compile(r'\S+')
+
+# Reuse connections to the Private AI API across requests
+REQUEST_TIMEOUT = 300
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+@dataclass(frozen=True)
 class EntityOccurrence:
-    def __init__(self, text: str, position: int, entity_type: str, entity_key: str, sentence: str):
-        self.text = text
-        self.position = position
-        self.entity_type = entity_type
-        self.entity_key = entity_key
-        self.sentence = sentence
+    # Declared explicitly rather than with slots=True, which needs Python 3.10
+    __slots__ = ('text', 'position', 'entity_type', 'entity_key', 'sentence')
+
+    text: str
+    position: int
+    entity_type: str
+    entity_key: str
+    sentence: str
     
     def __repr__(self):
         return f"{self.text} ({self.entity_type}, pos:{self.position})"
 
-def extract_named_entities(text, desired_types):
-    """Extract named entities using Private AI API."""
-    logging.info('Making request to Private AI API...')
+def iter_response_entities(stream) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Yield (document index, entity) pairs from a Private AI response as it is parsed."""
+    document_index = -1
+    builder = None
+    
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if prefix == 'item' and event == 'start_map':
+            document_index += 1
+        elif prefix == 'item.entities.item' and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+        
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == 'item.entities.item' and event == 'end_map':
+                yield document_index, builder.value
+                builder = None
+
+def build_entity_dict(text: str, entities: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Group the API entities for one document by entity key, with positions and context."""
+    entity_dict = {}
+    text_length = len(text)
+    words = text.split()
+    word_starts = [match.start() for match in WORD_PATTERN.finditer(text)]
+
+    for entity in entities:
+        entity_key = entity.get('processed_text', '')
+        entity_type = entity.get('best_label', '')
+        if not entity_key or not entity_type:
+            logging.warning(f"Skipping entity due to missing key or type: {entity}")
+            continue
+
+        if entity_key not in entity_dict:
+            entity_dict[entity_key] = {
+                'text': entity.get('text', ''),
+                'type': entity_type,
+                'positions': [],
+                'sentences': []
+            }
+
+        location = entity.get('location', {})
+        start_pos = location.get('stt_idx')
+        end_pos = location.get('end_idx')
+
+        if start_pos is not None and end_pos is not None:
+            normalized_pos = int((start_pos / text_length) * 100)
+            entity_dict[entity_key]['positions'].append(normalized_pos)
+
+            # Number of words starting before the entity, i.e. those in text[:start_pos]
+            entity_start_word = bisect.bisect_left(word_starts, start_pos)
+            start_word = max(0, entity_start_word - 10)
+            end_word = min(len(words), entity_start_word + 10)
+
+            context = ' '.join(words[start_word:end_word])
+            entity_dict[entity_key]['sentences'].append(context)
+        else:
+            logging.warning(f"Skipping context extraction for entity due to missing position information: {entity}")
+
+    return entity_dict
+
+def request_named_entities(texts: List[str], desired_types) -> List[Dict[str, Any]]:
+    """Extract named entities for several documents in a single Private AI API request."""
+    logging.info(f'Making request to Private AI API for {len(texts)} document(s)...')
     
     if not PRIVATE_AI_API_KEY:
         raise ValueError("PRIVATE_AI_API_KEY environment variable not set")
-        
-    url = "https://api.private-ai.com/community/v3/process/text"
 
     entity_types = [{"type": "ENABLE", "value": [entity_type]} for entity_type in desired_types]
 
     payload = {
-        "text": [text],
+        "text": texts,
         "link_batch": False,
         "entity_detection": {
             "accuracy": "high",
@@ -59,50 +140,20 @@ def extract_named_entities(text, desired_types):
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        
-        data = response.json()
-        logging.info(f"API Response: {data}")
-        
-        entity_dict = {}
-        text_length = len(text)
-        words = re.findall(r'\S+', text)
+        with _SESSION.post(PRIVATE_AI_URL, json=payload, headers=headers, timeout=REQUEST_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            # Let urllib3 undo any gzip/deflate encoding while ijson reads the raw stream
+            response.raw.decode_content = True
+            
+            # The API returns one result per input text, in request order, so entities
+            # arrive grouped by document and each group is consumed as it is parsed
+            batch_entities = [{} for _ in texts]
+            for idx, document_entities in groupby(iter_response_entities(response.raw), key=itemgetter(0)):
+                batch_entities[idx] = build_entity_dict(texts[idx], (entity for _, entity in document_entities))
         
-        if data and len(data) > 0 and 'entities' in data[0]:
-            for entity in data[0]['entities']:
-                entity_key = entity.get('processed_text', '')
-                entity_type = entity.get('best_label', '')
-                if not entity_key or not entity_type:
-                    logging.warning(f"Skipping entity due to missing key or type: {entity}")
-                    continue
-                
-                if entity_key not in entity_dict:
-                    entity_dict[entity_key] = {
-                        'text': entity.get('text', ''),
-                        'type': entity_type,
-                        'positions': [],
-                        'sentences': []
-                    }
-                
-                location = entity.get('location', {})
-                start_pos = location.get('stt_idx')
-                end_pos = location.get('end_idx')
-                
-                if start_pos is not None and end_pos is not None:
-                    normalized_pos = int((start_pos / text_length) * 100)
-                    entity_dict[entity_key]['positions'].append(normalized_pos)
-                    
-                    entity_start_word = len(re.findall(r'\S+', text[:start_pos]))
-                    start_word = max(0, entity_start_word - 10)
-                    end_word = min(len(words), entity_start_word + 10)
-                    
-                    context = ' '.join(words[start_word:end_word])
-                    entity_dict[entity_key]['sentences'].append(context)
-                else:
-                    logging.warning(f"Skipping context extraction for entity due to missing position information: {entity}")
-        
-        return entity_dict
+        logging.info(f"API Response: {sum(len(entities) for entities in batch_entities)} entities "
+                     f"across {len(texts)} document(s)")
+        return batch_entities
         
     except requests.exceptions.HTTPError as e:
         if response.status_code == 403:
@@ -114,6 +165,49 @@ def extract_named_entities(text, desired_types):
         logger.error(f"Error in API request: {e}")
         raise
 
+def entity_cache_path(cache_dir: str, text: str, desired_types) -> str:
+    """Cache file for one text's entities, keyed by the API endpoint, entity types and content."""
+    key = hashlib.blake2b(orjson.dumps([PRIVATE_AI_URL, sorted(desired_types), text]), digest_size=16).hexdigest()
+    return os.path.join(cache_dir, f'{key}.json')
+
+def load_cached_entities(cache_file: str) -> Optional[Dict[str, Any]]:
+    """Return the cached entities for a text, or None on a cache miss."""
+    try:
+        with open(cache_file, 'rb') as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+def save_cached_entities(cache_file: str, entities: Dict[str, Any]):
+    """Write entities to the cache, replacing the file atomically so concurrent readers never see a partial write."""
+    with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(cache_file), suffix='.tmp', delete=False) as f:
+        f.write(orjson.dumps(entities))
+    os.replace(f.name, cache_file)
+
+def extract_named_entities_batch(texts: List[str], desired_types,
+                                 cache_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Extract named entities for several documents, requesting only those missing from the cache."""
+    if not cache_dir:
+        return request_named_entities(texts, desired_types)
+    
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_files = [entity_cache_path(cache_dir, text, desired_types) for text in texts]
+    batch_entities = [load_cached_entities(cache_file) for cache_file in cache_files]
+    
+    missing = [idx for idx, entities in enumerate(batch_entities) if entities is None]
+    logger.info(f"Loaded {len(texts) - len(missing)} of {len(texts)} document(s) from cache")
+    if missing:
+        fetched = request_named_entities([texts[idx] for idx in missing], desired_types)
+        for idx, entities in zip(missing, fetched):
+            save_cached_entities(cache_files[idx], entities)
+            batch_entities[idx] = entities
+    
+    return batch_entities
+
+def extract_named_entities(text, desired_types, cache_dir: Optional[str] = None):
+    """Extract named entities using Private AI API."""
+    return extract_named_entities_batch([text], desired_types, cache_dir)[0]
+
 def organize_entities_by_position(entities_json: Dict[str, Any]) -> List[EntityOccurrence]:
     """Organize entities by their positions in the transcript."""
     occurrences = []
@@ -131,17 +225,25 @@ def organize_entities_by_position(entities_json: Dict[str, Any]) -> List[EntityO
             )
             occurrences.append(occurrence)
     
-    return sorted(occurrences, key=lambda x: x.position)
+    return sorted(occurrences, key=attrgetter('position'))
 
-def process_transcript(transcript: str, output_dir: str, entity_types: List[str]):
-    """Process a transcript and generate entity and timeline files."""
-    # Extract entities
-    entities = extract_named_entities(transcript, entity_types)
-    
+def write_json_array(f, items: Iterable[Any]):
+    """Write items to a binary file as an indented JSON array, serializing one element at a time."""
+    f.write(b'[')
+    empty = True
+    for item in items:
+        f.write(b'\n  ' if empty else b',\n  ')
+        # orjson escapes newlines inside strings, so every raw newline is layout and can be indented
+        f.write(orjson.dumps(item, option=orjson.OPT_INDENT_2).replace(b'\n', b'\n  '))
+        empty = False
+    f.write(b']' if empty else b'\n]')
+
+def save_entity_outputs(entities: Dict[str, Any], output_dir: str):
+    """Write the entity and timeline files for one transcript."""
     # Save entities to file
     entities_file = os.path.join(output_dir, 'entities.json')
-    with open(entities_file, 'w', encoding='utf-8') as f:
-        json.dump(entities, f, indent=2)
+    with open(entities_file, 'wb') as f:
+        f.write(orjson.dumps(entities, option=orjson.OPT_INDENT_2))
     logger.info(f"Entities saved to {entities_file}")
     
     # Organize entities
@@ -149,39 +251,123 @@ def process_transcript(transcript: str, output_dir: str, entity_types: List[str]
     
     # Save timeline to file
     timeline_file = os.path.join(output_dir, 'timeline.json')
-    timeline_data = [
-        {
-            'text': occ.text,
-            'position': occ.position,
-            'entity_type': occ.entity_type,
-            'entity_key': occ.entity_key,
-            'sentence': occ.sentence
-        }
-        for occ in occurrences
-    ]
-    with open(timeline_file, 'w', encoding='utf-8') as f:
-        json.dump(timeline_data, f, indent=2)
+    # orjson serializes the dataclass fields directly, in declaration order
+    with open(timeline_file, 'wb') as f:
+        write_json_array(f, occurrences)
     logger.info(f"Timeline saved to {timeline_file}")
 
+def process_transcripts_batch(transcripts: List[str], output_dirs: List[str], entity_types: List[str],
+                              cache_dir: Optional[str] = None):
+    """Process several transcripts with one API request, writing each to its own output directory."""
+    # Extract entities
+    batch_entities = extract_named_entities_batch(transcripts, entity_types, cache_dir)
+    
+    for entities, output_dir in zip(batch_entities, output_dirs):
+        save_entity_outputs(entities, output_dir)
+
+def process_transcript(transcript: str, output_dir: str, entity_types: List[str],
+                       cache_dir: Optional[str] = None):
+    """Process a transcript and generate entity and timeline files."""
+    process_transcripts_batch([transcript], [output_dir], entity_types, cache_dir)
+
+def process_transcript_files(transcript_files: List[str], output_dirs: List[str], entity_types: List[str],
+                             cache_dir: Optional[str] = None):
+    """Read a batch of transcript files and process them with one API request."""
+    transcripts = []
+    for transcript_file in transcript_files:
+        with open(transcript_file, 'r', encoding='utf-8') as f:
+            transcripts.append(f.read())
+    
+    for output_dir in output_dirs:
+        os.makedirs(output_dir, exist_ok=True)
+    
+    process_transcripts_batch(transcripts, output_dirs, entity_types, cache_dir)
+
+def corpus_output_dirs(transcript_files: List[str], output_dir: str) -> List[str]:
+    """Give each transcript file its own output directory.
+
+    A single transcript writes directly into output_dir. Several transcripts mirror their paths
+    below the files' common directory, minus the extension, so a/call.txt and b/call.txt go to
+    output_dir/a/call and output_dir/b/call. Files that would still share a directory (call.txt
+    and call.md) raise ValueError rather than overwrite each other.
+    """
+    if len(transcript_files) == 1:
+        return [output_dir]
+    
+    paths = [os.path.abspath(path) for path in transcript_files]
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    output_dirs = [os.path.join(output_dir, os.path.splitext(os.path.relpath(path, root))[0]) for path in paths]
+    
+    collisions = sorted(directory for directory, count in Counter(output_dirs).items() if count > 1)
+    if collisions:
+        raise ValueError(f"Transcript files would share output directories: {', '.join(collisions)}")
+    return output_dirs
+
+def process_corpus(transcript_files: List[str], output_dir: str, entity_types: List[str],
+                   batch_size: int = 1, max_workers: int = 8, cache_dir: Optional[str] = None) -> Iterator[str]:
+    """Process transcript files concurrently, yielding each file once its outputs are written.
+
+    Files listed more than once (or matched by several patterns) are processed once; see
+    corpus_output_dirs for where each transcript's outputs go.
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be at least 1, got {batch_size}")
+    
+    unique_files = {}
+    for path in transcript_files:
+        unique_files.setdefault(os.path.realpath(path), path)
+    transcript_files = list(unique_files.values())
+    output_dirs = corpus_output_dirs(transcript_files, output_dir)
+    
+    batches = [
+        (transcript_files[start:start + batch_size], output_dirs[start:start + batch_size])
+        for start in range(0, len(transcript_files), batch_size)
+    ]
+    
+    # Requests are I/O bound, so threads keep several API calls in flight at once
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(process_transcript_files, files, dirs, entity_types, cache_dir): files
+            for files, dirs in batches
+        }
+        for future in as_completed(futures):
+            future.result()
+            yield from futures[future]
+
 def main():
     parser = argparse.ArgumentParser(description='Process transcript and extract entities')
-    parser.add_argument('transcript_file', help='Path to the transcript file')
+    parser.add_argument('transcript_files', nargs='+',
+                        help='Paths or glob patterns of the transcript files')
     parser.add_argument('output_dir', help='Directory to store output files')
     parser.add_argument('--entity_types', nargs='+', default=['NAME', 'ORGANIZATION'],
                         help='Entity types to extract (default: NAME ORGANIZATION)')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='Transcripts sent per API request (default: 1)')
+    parser.add_argument('--max_workers', type=int, default=8,
+                        help='Maximum concurrent API requests (default: 8)')
+    parser.add_argument('--cache_dir',
+                        help='Directory for cached API results; transcripts seen before skip the API')
     
     args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error('--batch_size must be at least 1')
+    if args.max_workers < 1:
+        parser.error('--max_workers must be at least 1')
     
     try:
+        # Expand glob patterns, keeping plain paths that match nothing so open() reports them
+        transcript_files = []
+        for pattern in args.transcript_files:
+            transcript_files.extend(sorted(glob.glob(pattern)) or [pattern])
+        
         # Create output directory if it doesn't exist
         os.makedirs(args.output_dir, exist_ok=True)
         
-        # Read transcript file
-        with open(args.transcript_file, 'r', encoding='utf-8') as f:
-            transcript = f.read()
-        
-        # Process transcript
-        process_transcript(transcript, args.output_dir, args.entity_types)
+        # Process transcripts
+        for transcript_file in process_corpus(transcript_files, args.output_dir, args.entity_types,
+                                              batch_size=args.batch_size, max_workers=args.max_workers,
+                                              cache_dir=args.cache_dir):
+            logger.info(f"Processed {transcript_file}")
         
     except Exception as e:
         logger.error(f"Error processing transcript: {e}")
@@ -191,3 +377,4 @@ if __name__ == "__main__":
     main()
 
 # python get_entities.py path/to/transcript.txt path/to/output/directory --entity_types NAME ORGANIZATION
+# python get_entities.py "path/to/transcripts/*.txt" path/to/output/directory --batch_size 4 --max_workers 8
@@ -1,14 +1,18 @@
 import argparse
 import os
-import json
+import orjson
 import logging
+import unicodedata
 from typing import List, Dict
-from fuzzywuzzy import fuzz
 from collections import defaultdict
+from rapidfuzz import fuzz, process
+from rapidfuzz.distance import JaroWinkler
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from functools import lru_cache
 from fuzzy import DMetaphone
 from jiwer import wer
 from whisper_normalizer.english import EnglishTextNormalizer
-from jarowinkler import jarowinkler_similarity
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -17,100 +21,195 @@ logger = logging.getLogger(__name__)
 # Initialize the Whisper normalizer
 normalizer = EnglishTextNormalizer()
 
+# Pretty-print output files; scores may be NumPy scalars
+JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+
+# Match scores are computed as integers scaled by this factor, the pass weights' common denominator
+SCORE_SCALE = 20
+
 def read_json_file(file_path: str) -> Dict:
     """Read JSON file and return its content."""
-    with open(file_path, 'r') as f:
-        return json.load(f)
+    with open(file_path, 'rb') as f:
+        return orjson.loads(f.read())
 
+@lru_cache(maxsize=4096)
 def normalize_text(text: str) -> str:
-    """Normalize text using Whisper normalizer."""
+    """Normalize text using Whisper normalizer, caching results for repeated strings."""
     return normalizer(text)
 
+def phonetic_code(dmetaphone: DMetaphone, text: str) -> list:
+    """Encode text with DMetaphone, folding accents to ASCII first since it only accepts ASCII."""
+    folded = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
+    try:
+        return dmetaphone(folded)
+    except UnicodeEncodeError:
+        return [None, None]
+
+def phonetic_codes(entity_lists: List[List[Dict]]) -> Dict[str, list]:
+    """Encode each distinct entity text with DMetaphone once."""
+    dmetaphone = DMetaphone()
+    unique_texts = {entity['text'] for entities in entity_lists for entity in entities}
+    return {text: phonetic_code(dmetaphone, text) for text in unique_texts}
+
+def entity_columns(entities: List[Dict], phon_cache: Dict[str, list]) -> Dict[str, list]:
+    """Precompute the per-entity values used for matching as parallel lists."""
+    phonetics = [phon_cache[entity['text']] for entity in entities]
+    return {
+        'text': [entity['text'].lower() for entity in entities],
+        'sentence': [entity['sentence'] for entity in entities],
+        'phonetic_primary': [codes[0] or '' for codes in phonetics],
+        'phonetic_secondary': [codes[1] or '' for codes in phonetics],
+        'position': np.array([entity['position'] for entity in entities], dtype=np.int16),
+        'entity_type': [entity['entity_type'] for entity in entities],
+    }
+
+def assign_pairs(scores: np.ndarray):
+    """Return the (row, col) pairs with the highest total score, using each row and column once.
+
+    Pairs scoring 0 are never matched. Rows and columns without any candidate are left out of
+    the assignment problem, which keeps it small for sparse score matrices.
+    """
+    rows = np.flatnonzero(scores.any(axis=1))
+    cols = np.flatnonzero(scores.any(axis=0))
+    if not len(rows):
+        return []
+
+    candidate_scores = scores
+    if len(rows) < scores.shape[0] or len(cols) < scores.shape[1]:
+        candidate_scores = scores[np.ix_(rows, cols)]
+    # linear_sum_assignment works on float64 costs; negating straight into one float64 array
+    # avoids the extra copies that maximize=True would make
+    row_ind, col_ind = linear_sum_assignment(np.negative(candidate_scores, dtype=np.float64))
+    accepted = candidate_scores[row_ind, col_ind] > 0
+    return list(zip(rows[row_ind[accepted]], cols[col_ind[accepted]]))
+
+def similarity_matrix(queries: List[str], choices: List[str]) -> np.ndarray:
+    """Compute fuzz.ratio for every query/choice pair as a uint8 matrix."""
+    return process.cdist(queries, choices, scorer=fuzz.ratio, dtype=np.uint8, workers=-1)
+
+def shared_codes(trans_values: list, truth_values: list):
+    """Encode two lists of values as integer arrays drawn from one shared vocabulary."""
+    codes = {}
+    trans_codes = np.array([codes.setdefault(value, len(codes)) for value in trans_values], dtype=np.int64)
+    truth_codes = np.array([codes.setdefault(value, len(codes)) for value in truth_values], dtype=np.int64)
+    return trans_codes, truth_codes
+
+def entity_type_blocks(trans: Dict[str, list], truth: Dict[str, list], position_tolerance: int):
+    """Split the entities into blocks that can only be matched within themselves.
+
+    Returns a (transcribed indices, truth indices) pair per block. Entities of different types
+    only match through identical text within the position tolerance, so each entity type is its
+    own block unless such a pair joins two types together.
+    """
+    parent = {entity_type: entity_type for entity_type in set(trans['entity_type']) | set(truth['entity_type'])}
+
+    def root(entity_type):
+        while parent[entity_type] != entity_type:
+            entity_type = parent[entity_type]
+        return entity_type
+
+    trans_positions = defaultdict(list)
+    truth_positions = defaultdict(list)
+    truth_types = defaultdict(set)
+    for text, entity_type, position in zip(trans['text'], trans['entity_type'], trans['position']):
+        trans_positions[text, entity_type].append(position)
+    for text, entity_type, position in zip(truth['text'], truth['entity_type'], truth['position']):
+        truth_positions[text, entity_type].append(position)
+        truth_types[text].add(entity_type)
+
+    for (text, trans_type), positions in trans_positions.items():
+        for truth_type in truth_types.get(text, set()) - {trans_type}:
+            if (root(trans_type) != root(truth_type) and
+                np.abs(np.subtract.outer(positions, truth_positions[text, truth_type])).min() <= position_tolerance):
+                parent[root(trans_type)] = root(truth_type)
+
+    blocks = defaultdict(lambda: ([], []))
+    for i, entity_type in enumerate(trans['entity_type']):
+        blocks[root(entity_type)][0].append(i)
+    for j, entity_type in enumerate(truth['entity_type']):
+        blocks[root(entity_type)][1].append(j)
+    return [(np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp))
+            for rows, cols in blocks.values() if rows and cols]
+
+def block_scores(trans: Dict[str, list], truth: Dict[str, list], rows: np.ndarray, cols: np.ndarray,
+                 position_tolerance: int) -> np.ndarray:
+    """Score every transcribed/truth pair in one block, scaled by SCORE_SCALE; pairs no pass accepts score 0.
+
+    The pass weights are multiples of 1/SCORE_SCALE, so scores are exact int16 values computed
+    in place: a few bytes per pair instead of a stack of float64 temporaries.
+    """
+    def take(column, indices):
+        return [column[idx] for idx in indices]
+
+    sentence = similarity_matrix(take(trans['sentence'], rows), take(truth['sentence'], cols))
+    text = similarity_matrix(take(trans['text'], rows), take(truth['text'], cols))
+    phonetic = np.maximum(similarity_matrix(take(trans['phonetic_primary'], rows), take(truth['phonetic_primary'], cols)),
+                          similarity_matrix(take(trans['phonetic_secondary'], rows), take(truth['phonetic_secondary'], cols)))
+    position_distance = np.abs(np.subtract.outer(trans['position'][rows], truth['position'][cols]))
+    within_tolerance = position_distance <= position_tolerance
+    buffer = np.empty(sentence.shape, dtype=np.int16)
+
+    # Relaxed pass: 0.6 * sentence + 0.3 * text + 0.1 * phonetic, accepted above 80
+    relaxed = np.multiply(sentence, 12, dtype=np.int16)
+    relaxed += np.multiply(text, 6, out=buffer, dtype=np.int16)
+    relaxed += np.multiply(phonetic, 2, out=buffer, dtype=np.int16)
+    relaxed[relaxed <= 80 * SCORE_SCALE] = 0
+
+    # Close pass: 0.5 * sentence + 0.3 * position + 0.15 * text + 0.05 * phonetic, where the
+    # position score is 100 - 10 * distance, accepted above 50 within the position tolerance
+    scores = np.multiply(sentence, 10, dtype=np.int16)
+    scores += np.multiply(text, 3, out=buffer, dtype=np.int16)
+    scores += phonetic
+    scores += 6 * 100
+    scores -= np.multiply(position_distance, 60, out=buffer, dtype=np.int16)
+    scores[~within_tolerance | (scores <= 50 * SCORE_SCALE)] = 0
+
+    # Each pair keeps its best score among the passes whose threshold it clears
+    np.maximum(scores, relaxed, out=scores)
+    del relaxed, buffer
+
+    # Only exact-text matches may cross entity types, which happens in merged blocks
+    trans_type_codes, truth_type_codes = shared_codes(take(trans['entity_type'], rows), take(truth['entity_type'], cols))
+    if len(np.union1d(trans_type_codes, truth_type_codes)) > 1:
+        scores[trans_type_codes[:, None] != truth_type_codes[None, :]] = 0
+
+    # Exact pass: identical text within tolerance and sentence similarity above 80
+    trans_text_codes, truth_text_codes = shared_codes(take(trans['text'], rows), take(truth['text'], cols))
+    exact = trans_text_codes[:, None] == truth_text_codes[None, :]
+    exact &= within_tolerance
+    exact &= sentence > 80
+    scores[exact] = 100 * SCORE_SCALE
+    return scores
+
 def match_entities(ground_truth: List[Dict], transcribed: List[Dict], position_tolerance: int = 10):
     matches = []
-    unmatched_truth = ground_truth.copy()
-    unmatched_transcribed = transcribed.copy()
+    matched_truth = np.zeros(len(ground_truth), dtype=bool)
+    matched_transcribed = np.zeros(len(transcribed), dtype=bool)
 
-    dmetaphone = DMetaphone()
+    phon_cache = phonetic_codes([ground_truth, transcribed])
+    truth = entity_columns(ground_truth, phon_cache)
+    trans = entity_columns(transcribed, phon_cache)
 
-    # First pass: Match entities with exact text, close positions, and high sentence similarity
-    for trans_entity in transcribed:
-        for truth_entity in unmatched_truth:
-            if (trans_entity['text'].lower() == truth_entity['text'].lower() and
-                abs(trans_entity['position'] - truth_entity['position']) <= position_tolerance):
-                sentence_similarity = fuzz.ratio(trans_entity['sentence'], truth_entity['sentence'])
-                if sentence_similarity > 80:
-                    matches.append({
-                        'truth': truth_entity,
-                        'transcribed': trans_entity,
-                        'score': 100
-                    })
-                    unmatched_truth.remove(truth_entity)
-                    unmatched_transcribed.remove(trans_entity)
-                    break
-
-    # Second pass: Matching based on sentence similarity, position, and entity type
-    for trans_entity in unmatched_transcribed[:]:
-        best_match = None
-        best_score = 0
-        
-        for truth_entity in unmatched_truth:
-            if (abs(trans_entity['position'] - truth_entity['position']) <= position_tolerance and
-                trans_entity['entity_type'] == truth_entity['entity_type']):
-                sentence_similarity = fuzz.ratio(trans_entity['sentence'], truth_entity['sentence'])
-                text_similarity = fuzz.ratio(trans_entity['text'].lower(), truth_entity['text'].lower())
-                
-                trans_phonetic = dmetaphone(trans_entity['text'])
-                truth_phonetic = dmetaphone(truth_entity['text'])
-                phonetic_similarity = max(fuzz.ratio(trans_phonetic[0], truth_phonetic[0]),
-                                          fuzz.ratio(trans_phonetic[1] or '', truth_phonetic[1] or ''))
-                
-                position_score = 100 - (abs(trans_entity['position'] - truth_entity['position']) * 10)
-                score = 0.5 * sentence_similarity + 0.3 * position_score + 0.15 * text_similarity + 0.05 * phonetic_similarity
-                
-                if score > best_score:
-                    best_score = score
-                    best_match = truth_entity
-
-        if best_match and best_score > 50:
-            matches.append({
-                'truth': best_match,
-                'transcribed': trans_entity,
-                'score': best_score
-            })
-            unmatched_truth.remove(best_match)
-            unmatched_transcribed.remove(trans_entity)
-
-    # Third pass: Try to match remaining entities with relaxed position constraint
-    for trans_entity in unmatched_transcribed[:]:
-        best_match = None
-        best_score = 0
-        
-        for truth_entity in unmatched_truth:
-            if trans_entity['entity_type'] == truth_entity['entity_type']:
-                sentence_similarity = fuzz.ratio(trans_entity['sentence'], truth_entity['sentence'])
-                text_similarity = fuzz.ratio(trans_entity['text'].lower(), truth_entity['text'].lower())
-                
-                trans_phonetic = dmetaphone(trans_entity['text'])
-                truth_phonetic = dmetaphone(truth_entity['text'])
-                phonetic_similarity = max(fuzz.ratio(trans_phonetic[0], truth_phonetic[0]),
-                                          fuzz.ratio(trans_phonetic[1] or '', truth_phonetic[1] or ''))
-                
-                score = 0.6 * sentence_similarity + 0.3 * text_similarity + 0.1 * phonetic_similarity
-                
-                if score > best_score:
-                    best_score = score
-                    best_match = truth_entity
-
-        if best_match and best_score > 80:
-            matches.append({
-                'truth': best_match,
-                'transcribed': trans_entity,
-                'score': best_score
-            })
-            unmatched_truth.remove(best_match)
-            unmatched_transcribed.remove(trans_entity)
+    # Entities only match within their entity-type block, so each block is scored and
+    # assigned on its own; rows are transcribed entities, columns are truth entities
+    for rows, cols in entity_type_blocks(trans, truth, position_tolerance):
+        scores = block_scores(trans, truth, rows, cols, position_tolerance)
+        for block_i, block_j in assign_pairs(scores):
+            i, j = rows[block_i], cols[block_j]
+            matches.append((i, j, scores[block_i, block_j] / SCORE_SCALE))
+            matched_truth[j] = True
+            matched_transcribed[i] = True
 
+    matches = [
+        {
+            'truth': ground_truth[j],
+            'transcribed': transcribed[i],
+            'score': float(score)
+        }
+        for i, j, score in sorted(matches)
+    ]
+    unmatched_truth = [entity for entity, matched in zip(ground_truth, matched_truth) if not matched]
+    unmatched_transcribed = [entity for entity, matched in zip(transcribed, matched_transcribed) if not matched]
     return matches, unmatched_truth, unmatched_transcribed
 
 def calculate_wer(truth_text: str, transcribed_text: str) -> float:
@@ -124,9 +223,11 @@ def calculate_pner(truth_entities: List[str], transcribed_entities: List[str]) -
     if not truth_entities:
         return 0.0
     
-    total_distance = sum(1 - jarowinkler_similarity(truth, trans) 
-                         for truth, trans in zip(truth_entities, transcribed_entities))
-    return total_distance / len(truth_entities)
+    # Pairwise like zip(): extra entities on either side are left out of the distance
+    paired = min(len(truth_entities), len(transcribed_entities))
+    similarities = process.cpdist(truth_entities[:paired], transcribed_entities[:paired],
+                                  scorer=JaroWinkler.normalized_similarity, dtype=np.float64, workers=-1)
+    return float(np.sum(1.0 - similarities)) / len(truth_entities)
 
 def calculate_pnwer(truth_entities: List[str], transcribed_entities: List[str]) -> float:
     """Calculate Proper Noun Word Error Rate (PNWER)."""
@@ -194,12 +295,12 @@ def main():
         
         # Save matching results
         matches_file = f"{args.output_folder}/matches.json"
-        with open(matches_file, 'w', encoding='utf-8') as f:
-            json.dump({
+        with open(matches_file, 'wb') as f:
+            f.write(orjson.dumps({
                 'matches': matches,
                 'unmatched_truth': unmatched_truth,
                 'unmatched_transcribed': unmatched_transcribed
-            }, f, indent=2)
+            }, option=JSON_OPTIONS))
         logger.info(f"Matching results saved to {matches_file}")
 
         # Generate statistics
@@ -216,8 +317,8 @@ def main():
 
         # Save statistics
         stats_file = f"{args.output_folder}/statistics.json"
-        with open(stats_file, 'w', encoding='utf-8') as f:
-            json.dump(stats, f, indent=2)
+        with open(stats_file, 'wb') as f:
+            f.write(orjson.dumps(stats, option=JSON_OPTIONS))
         logger.info(f"Statistics saved to {stats_file}")
 
         # Print summary